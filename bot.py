@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import os, sys, time, json, logging, asyncio, threading
+import os, sys, time, json, socket, logging, asyncio, threading
 import importlib.util
 from datetime import datetime
 from pytz import timezone
@@ -29,6 +29,15 @@ TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 SPREADSHEET_NAME = "雲端提醒"
 TAIPEI_TZ = timezone('Asia/Taipei')
 
+# 共用資料模式 (多副本部署)：設定 SHARED_DB_PATH 後，所有副本共用同一個 SQLite 檔案
+# 注意：所有副本必須在同一台主機、且檔案放在本機磁碟 (不可為 NFS 等網路檔案系統)，否則租約無法互斥
+# K 線快取在 BAR_CACHE_MAX_AGE 秒內直接沿用；超過時仍會重新下載，下載失敗才退回使用過期的快取，
+# 因此接手的副本在 Yahoo 無法連線時仍能以最近一次的資料回應
+SHARED_DB_PATH = os.environ.get("SHARED_DB_PATH")
+REPLICA_ID = os.environ.get("REPLICA_ID") or f"{socket.gethostname()}-{os.getpid()}"
+LEADER_LEASE_SECONDS = int(os.environ.get("LEADER_LEASE_SECONDS", 90))
+BAR_CACHE_MAX_AGE = int(os.environ.get("BAR_CACHE_MAX_AGE", 600))
+
 def safe_get_chat_id():
     val = os.environ.get("TELEGRAM_CHAT_ID")
     if not val: return None
@@ -41,6 +50,7 @@ def safe_get_chat_id():
 # 全域變數
 ANALYZE_FUNC = None
 ta_helpers = None
+SHARED_STORE = None
 
 # --- 3. 核心模組動態加載 ---
 try:
@@ -57,6 +67,16 @@ try:
 except Exception as e:
     logger.error(f"❌ 模組載入失敗: {e}")
 
+if SHARED_DB_PATH:
+    try:
+        from shared_store import SharedStore
+        SHARED_STORE = SharedStore(SHARED_DB_PATH, REPLICA_ID, LEADER_LEASE_SECONDS, BAR_CACHE_MAX_AGE)
+        logger.info(f"✅ 共用資料模式啟用: {SHARED_DB_PATH} (副本 {REPLICA_ID})")
+    except Exception as e:
+        # 設定了共用資料模式卻無法協調時，不可退回單機模式 (會變成不受協調的 leader 而重複發送警報)
+        logger.error(f"❌ 共用資料庫初始化失敗，停止啟動: {e}")
+        sys.exit(1)
+
 # --- 4. 資料處理函式 ---
 def get_google_sheets_client():
     creds_json = os.environ.get("GOOGLE_CREDENTIALS")
@@ -93,29 +113,40 @@ def fetch_stock_data_for_reminder():
         return pd.DataFrame()
 
 # --- 5. 核心執行任務 ---
+# 同一時間只允許一個分析任務 (例如 /run 與排程重疊)，避免兩次執行都讀到舊的去重日期而重複發送
+ANALYSIS_LOCK = asyncio.Lock()
+
+def fetch_and_analyze():
+    # 讀取試算表、下載與分析皆為阻塞操作，由 run_analysis_and_send 放到背景執行緒執行
+    stock_df = fetch_stock_data_for_reminder()
+    if stock_df.empty or not ANALYZE_FUNC: return None
+
+    gc = get_google_sheets_client()
+    # 呼叫分析函數。注意：去重的邏輯通常寫在 ta_analyzer.py 裡面
+    # 它會比對 Excel 中的「去重日期」欄位
+    return ANALYZE_FUNC(gc, SPREADSHEET_NAME, stock_df['代號'].tolist(), stock_df, SHARED_STORE)
+
 async def run_analysis_and_send(bot):
     target_id = safe_get_chat_id()
     if not target_id:
         logger.warning("‼️ 找不到 TELEGRAM_CHAT_ID")
         return False
-        
-    now_taipei = datetime.now(TAIPEI_TZ)
-    logger.info(f"⏰ 啟動分析任務: {now_taipei.strftime('%Y-%m-%d %H:%M:%S')}")
-    
-    stock_df = fetch_stock_data_for_reminder()
-    if stock_df.empty: return False
 
-    gc = get_google_sheets_client()
-    if ANALYZE_FUNC:
-        # 呼叫分析函數。注意：去重的邏輯通常寫在 ta_analyzer.py 裡面
-        # 它會比對 Excel 中的「去重日期」欄位
-        alerts = ANALYZE_FUNC(gc, SPREADSHEET_NAME, stock_df['代號'].tolist(), stock_df)
-        
+    async with ANALYSIS_LOCK:
+        now_taipei = datetime.now(TAIPEI_TZ)
+        logger.info(f"⏰ 啟動分析任務: {now_taipei.strftime('%Y-%m-%d %H:%M:%S')}")
+
+        # 在背景執行緒中執行，避免阻塞事件迴圈 (指令回應與租約續約才能持續進行)
+        alerts = await asyncio.to_thread(fetch_and_analyze)
+        if alerts is None: return False
+
         if alerts:
             header = f"🔔 *技術指標警報 ({now_taipei.strftime('%H:%M:%S')})*"
             await bot.send_message(chat_id=target_id, text=header, parse_mode='Markdown')
-            for msg in alerts:
+            for alert in alerts:
                 try:
+                    # 警報紀錄在發送時才格式化成 Markdown 訊息
+                    msg = ta_helpers.format_alert_message(alert)
                     await bot.send_message(chat_id=target_id, text=msg, parse_mode='Markdown', disable_web_page_preview=True)
                     await asyncio.sleep(0.8) # 稍微增加延遲避免被 Telegram 阻擋
                 except Exception as e:
@@ -126,7 +157,23 @@ async def run_analysis_and_send(bot):
     return False
 
 # --- 6. Telegram 任務接口 ---
+def is_leader():
+    # 單機模式永遠是 leader；共用資料模式下需取得 (或續約) 領導者租約
+    if not SHARED_STORE: return True
+    try:
+        return SHARED_STORE.try_acquire_leader()
+    except Exception as e:
+        logger.error(f"❌ 領導者租約檢查失敗: {e}")
+        return False
+
+async def lease_renew_job(context: ContextTypes.DEFAULT_TYPE):
+    # SQLite 呼叫會阻塞，放到背景執行緒以免卡住 PTB 事件迴圈
+    await asyncio.to_thread(is_leader)
+
 async def periodic_reminder_job(context: ContextTypes.DEFAULT_TYPE):
+    if not await asyncio.to_thread(is_leader):
+        logger.info(f"⏭️ {REPLICA_ID} 非 leader，排程分析交由其他副本執行")
+        return
     await run_analysis_and_send(context.bot)
 
 async def run_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -145,26 +192,44 @@ def setup_scheduling(job_queue: JobQueue):
     job_queue.run_custom(periodic_reminder_job, job_kwargs={'trigger': 'cron', 'minute': '0,30', 'hour': '8-13', 'day_of_week': 'mon-fri', 'timezone': TAIPEI_TZ}, name='Market_Hours')
     # 收盤提醒
     job_queue.run_custom(periodic_reminder_job, job_kwargs={'trigger': 'cron', 'minute': '40', 'hour': '13', 'day_of_week': 'mon-fri', 'timezone': TAIPEI_TZ}, name='Closing')
+    # 共用資料模式：持續續約領導者租約，leader 停止後其他副本會在租約過期時接手
+    if SHARED_STORE:
+        job_queue.run_repeating(lease_renew_job, interval=max(LEADER_LEASE_SECONDS // 3, 1), first=0, name='Leader_Lease')
 
 # --- 8. Web 服務 ---
 app = Flask(__name__)
 @app.route('/')
 @app.route('/health')
 def health_check():
-    return jsonify({"status": "ok", "server_time": datetime.now(TAIPEI_TZ).strftime('%Y-%m-%d %H:%M:%S')}), 200
+    status = {"status": "ok", "server_time": datetime.now(TAIPEI_TZ).strftime('%Y-%m-%d %H:%M:%S')}
+    if SHARED_STORE:
+        try:
+            leader = SHARED_STORE.current_leader()
+        except Exception:
+            leader = None
+        status.update({"replica": REPLICA_ID, "leader": leader, "role": "leader" if leader == REPLICA_ID else "follower"})
+    return jsonify(status), 200
 
 def run_flask():
     port = int(os.environ.get('PORT', 8080))
     app.run(host='0.0.0.0', port=port, debug=False, use_reloader=False)
 
 # --- 9. 主程式入口 ---
+async def release_leader_on_shutdown(application: Application):
+    # 滾動部署時主動釋放租約，讓其他副本不必等租約過期即可接手
+    if SHARED_STORE:
+        try:
+            await asyncio.to_thread(SHARED_STORE.release_leader)
+        except Exception as e:
+            logger.error(f"❌ 釋放領導者租約失敗: {e}")
+
 def main():
     threading.Thread(target=run_flask, daemon=True).start()
     if not TELEGRAM_BOT_TOKEN:
         logger.error("❌ 找不到 TELEGRAM_BOT_TOKEN")
         return
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    application = Application.builder().token(TELEGRAM_BOT_TOKEN).post_shutdown(release_leader_on_shutdown).build()
     setup_scheduling(application.job_queue)
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("run", run_command))
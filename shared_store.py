@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# shared_store.py (多副本共用資料：領導者租約 / K 線快取 / 警報去重狀態)
+import json, time, sqlite3, logging
+from contextlib import closing
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# --- 1. 資料表結構 ---
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leader_lease (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bar_cache (
+    ticker TEXT PRIMARY KEY,
+    fetched_at REAL NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS alert_state (
+    stock_code TEXT NOT NULL,
+    signal_name TEXT NOT NULL,
+    alert_date TEXT NOT NULL,
+    holder TEXT NOT NULL,
+    PRIMARY KEY (stock_code, signal_name, alert_date)
+);
+"""
+
+
+class SharedStore:
+    """
+    以本機 SQLite 檔案作為多個 bot.py 副本之間的協調儲存區。
+    所有副本必須跑在同一台主機上並指向同一個本機檔案路徑：WAL 模式與 BEGIN IMMEDIATE
+    租約依賴共享記憶體與正常運作的 POSIX 檔案鎖，放在 NFS 等網路檔案系統或跨主機共用時，
+    租約將無法保證互斥。每次操作各自開啟連線，可安全地在 ThreadPoolExecutor 的下載執行緒中使用。
+    """
+
+    # 租約相關操作的鎖等待秒數：遇到其他副本持有寫入鎖時很快放棄，視為「非 leader」
+    LEASE_LOCK_TIMEOUT = 1
+
+    def __init__(self, path: str, replica_id: str, lease_seconds: int = 90, bar_max_age: int = 600):
+        self.path = path
+        self.replica_id = replica_id
+        self.lease_seconds = lease_seconds
+        self.bar_max_age = bar_max_age
+        with closing(self._connect()) as conn:
+            # WAL 需要同一主機上的共享記憶體，請勿把資料庫放在網路檔案系統上
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self, timeout: float = 30) -> sqlite3.Connection:
+        # isolation_level=None：由下方自行控制 BEGIN IMMEDIATE，確保租約搶占為原子操作
+        return sqlite3.connect(self.path, timeout=timeout, isolation_level=None)
+
+    # --- 2. 領導者租約 ---
+    def try_acquire_leader(self, name: str = "scheduler") -> bool:
+        """取得或續約領導者租約；租約由他人持有且尚未過期，或資料庫被鎖住時回傳 False。"""
+        now = time.time()
+        with closing(self._connect(self.LEASE_LOCK_TIMEOUT)) as conn:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                logger.warning(f"⚠️ 領導者租約被鎖住，本次視為非 leader: {e}")
+                return False
+            try:
+                row = conn.execute("SELECT holder, expires_at FROM leader_lease WHERE name = ?", (name,)).fetchone()
+                if row and row[0] != self.replica_id and row[1] > now:
+                    conn.execute("COMMIT")
+                    return False
+                conn.execute(
+                    "INSERT OR REPLACE INTO leader_lease (name, holder, expires_at) VALUES (?, ?, ?)",
+                    (name, self.replica_id, now + self.lease_seconds)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if not row or row[0] != self.replica_id:
+            logger.info(f"👑 {self.replica_id} 取得領導者租約 ({name})")
+        return True
+
+    def release_leader(self, name: str = "scheduler") -> None:
+        """釋放自己持有的租約（例如滾動部署關機時），讓其他副本立即接手。"""
+        with closing(self._connect(self.LEASE_LOCK_TIMEOUT)) as conn:
+            conn.execute("DELETE FROM leader_lease WHERE name = ? AND holder = ?", (name, self.replica_id))
+
+    def current_leader(self, name: str = "scheduler"):
+        with closing(self._connect(self.LEASE_LOCK_TIMEOUT)) as conn:
+            row = conn.execute("SELECT holder, expires_at FROM leader_lease WHERE name = ?", (name,)).fetchone()
+        return row[0] if row and row[1] > time.time() else None
+
+    # --- 3. K 線快取 ---
+    def get_bars(self, ticker: str, allow_stale: bool = False):
+        """
+        回傳 bar_max_age 秒內由任一副本下載的 K 線 (Close/High/Low)，沒有則回傳 None。
+        allow_stale=True 時忽略 bar_max_age，供下載失敗時退回使用最近一次的資料。
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT fetched_at, payload FROM bar_cache WHERE ticker = ?", (ticker,)).fetchone()
+        if not row or (not allow_stale and time.time() - row[0] > self.bar_max_age):
+            return None
+        data = json.loads(row[1])
+        return pd.DataFrame(
+            {'Close': data['close'], 'High': data['high'], 'Low': data['low']},
+            index=pd.to_datetime(data['index'])
+        )
+
+    def put_bars(self, ticker: str, df: pd.DataFrame) -> None:
+        def first_col(col_name):
+            col_data = df[col_name]
+            # 與 ta_analyzer 相同：多個 sub-column 時取第一欄
+            if len(col_data.shape) > 1:
+                col_data = col_data.iloc[:, 0]
+            return col_data.values.flatten().astype(float).tolist()
+
+        payload = json.dumps({
+            'index': [ts.isoformat() for ts in df.index],
+            'close': first_col('Close'), 'high': first_col('High'), 'low': first_col('Low'),
+        })
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO bar_cache (ticker, fetched_at, payload) VALUES (?, ?, ?)",
+                (ticker, time.time(), payload)
+            )
+
+    # --- 4. 警報去重狀態 ---
+    def claim_alert(self, stock_code: str, signal_name: str, alert_date: str) -> bool:
+        """原子地登記今日警報；只有第一個登記的副本會得到 True，其餘副本應跳過發送。"""
+        with closing(self._connect()) as conn:
+            # 去重只需要今日的紀錄，順便清掉較早日期的舊資料
+            conn.execute("DELETE FROM alert_state WHERE alert_date < ?", (alert_date,))
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO alert_state (stock_code, signal_name, alert_date, holder) VALUES (?, ?, ?, ?)",
+                (stock_code, signal_name, alert_date, self.replica_id)
+            )
+            return cur.rowcount == 1
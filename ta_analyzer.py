@@ -54,6 +54,22 @@ COLUMN_MAP = {
     'MA_TANGLE': 'Z',     'SLOPE_DESC': 'AA',    'BIAS_Val': 'Y'
 }
 
+# 讀取舊資料列所需的欄位：key -> (中文表頭, 找不到表頭時的預設索引, 預設值)
+SHEET_FIELDS = {
+    'KD_SWITCH': ('KD_通知開關', 10, 'ON'),
+    'MACD_SWITCH': ('MACD_通知開關', 13, 'ON'),
+    'KD_ALERT_DATE': ('KD_去重日期', 11, ''),
+    'MACD_ALERT_DATE': ('MACD_去重日期', 14, ''),
+    'PROVIDER': ('提供者', 2, ''),
+}
+
+def build_column_plan(header_to_index):
+    """每次執行只解析一次表頭，得到 key -> (欄位索引, 預設值) 的欄位計畫。"""
+    return {
+        key: (header_to_index.get(header, fallback_idx), default)
+        for key, (header, fallback_idx, default) in SHEET_FIELDS.items()
+    }
+
 def excel_col_to_index(col_letter):
     index = 0
     for i, letter in enumerate(reversed(col_letter.upper())):
@@ -61,20 +77,42 @@ def excel_col_to_index(col_letter):
     return index - 1
 
 # --- 3. 下載器 ---
-def download_one_stock(ticker):
+def download_one_stock(ticker, store=None):
     clean_ticker = ticker.split('"')[-2] if '"' in ticker else ticker
     clean_ticker = clean_ticker.strip()
     if clean_ticker.isdigit() and len(clean_ticker) <= 4: clean_ticker += ".TW"
+    # 共用資料模式：優先使用其他副本近期下載的 K 線
+    if store:
+        try:
+            cached = store.get_bars(clean_ticker)
+            if cached is not None and len(cached) >= 20:
+                return clean_ticker, "ok", cached
+        except Exception as e:
+            logger.warning(f"⚠️ {clean_ticker} 讀取共用快取失敗: {e}")
     try:
         df = yf.download(clean_ticker, period="6mo", interval="1d", progress=False, auto_adjust=True)
         if not df.empty and len(df) >= 20:
+            if store:
+                try:
+                    store.put_bars(clean_ticker, df)
+                except Exception as e:
+                    logger.warning(f"⚠️ {clean_ticker} 寫入共用快取失敗: {e}")
             return clean_ticker, "ok", df
     except Exception as e:
         logger.warning(f"⚠️ {clean_ticker} 下載失敗: {e}")
+    # 下載失敗或資料不足時，退回使用共用快取中過期的 K 線 (例如剛接手的副本無法連上 Yahoo)
+    if store:
+        try:
+            stale = store.get_bars(clean_ticker, allow_stale=True)
+            if stale is not None and len(stale) >= 20:
+                logger.warning(f"⚠️ {clean_ticker} 改用共用快取中過期的 K 線")
+                return clean_ticker, "ok", stale
+        except Exception as e:
+            logger.warning(f"⚠️ {clean_ticker} 讀取共用快取失敗: {e}")
     return clean_ticker, "error", None
 
 # --- 4. 主分析函式 ---
-def analyze_and_update_sheets(gc, spreadsheet_name, stock_codes, stock_df):
+def analyze_and_update_sheets(gc, spreadsheet_name, stock_codes, stock_df, store=None):
     alerts = []
     taipei_now = datetime.now(TAIPEI_TZ)
     current_date_obj = taipei_now.date()
@@ -103,6 +141,7 @@ def analyze_and_update_sheets(gc, spreadsheet_name, stock_codes, stock_df):
                 logger.info(f"✅ 找到欄位: {field} -> 索引 {header_to_index[field]}")
             else:
                 logger.warning(f"⚠️ 未找到欄位: {field}")
+        column_plan = build_column_plan(header_to_index)
 
         # 建立股票代碼到行索引的映射
         code_to_row = {}
@@ -113,7 +152,7 @@ def analyze_and_update_sheets(gc, spreadsheet_name, stock_codes, stock_df):
 
         successful_data = {}
         with ThreadPoolExecutor(max_workers=3) as executor:
-            futures = {executor.submit(download_one_stock, c): c for c in stock_codes}
+            futures = {executor.submit(download_one_stock, c, store): c for c in stock_codes}
             for f in as_completed(futures):
                 ticker, status, data = f.result()
                 if status == "ok": successful_data[ticker] = data
@@ -143,38 +182,12 @@ def analyze_and_update_sheets(gc, spreadsheet_name, stock_codes, stock_df):
                 logger.error(f"❌ {code} 數據深度清洗失敗: {e}")
                 continue
 
-            # 讀取舊資料列（使用中文欄位名稱）
+            # 讀取舊資料列（欄位索引已在 column_plan 中解析完成）
             old_row = all_rows[row_idx - 1]
             
-            # 使用中文欄位名稱讀取數據
-            row_data = {
-                'KD_SWITCH': old_row[header_to_index.get('KD_通知開關', 10)] if len(old_row) > 10 else 'ON',
-                'MACD_SWITCH': old_row[header_to_index.get('MACD_通知開關', 13)] if len(old_row) > 13 else 'ON',
-                'MA5_MA10_SWITCH': old_row[header_to_index.get('MA5/10_通知開關', 16)] if len(old_row) > 16 else 'ON',
-                'MA5_MA20_SWITCH': old_row[header_to_index.get('MA5/20_通知開關', 19)] if len(old_row) > 19 else 'ON',
-                'MA10_MA20_SWITCH': old_row[header_to_index.get('MA10/20_通知開關', 22)] if len(old_row) > 22 else 'ON',
-                'BIAS_SWITCH': old_row[header_to_index.get('乖離率_通知開關', 25)] if len(old_row) > 25 else 'ON',
-                
-                'KD_ALERT_DATE': old_row[header_to_index.get('KD_去重日期', 11)] if len(old_row) > 11 else '',
-                'MACD_ALERT_DATE': old_row[header_to_index.get('MACD_去重日期', 14)] if len(old_row) > 14 else '',
-                'MA5_MA10_ALERT_DATE': old_row[header_to_index.get('MA5/10_去重日期', 17)] if len(old_row) > 17 else '',
-                'MA5_MA20_ALERT_DATE': old_row[header_to_index.get('MA5/20_去重日期', 20)] if len(old_row) > 20 else '',
-                'MA10_MA20_ALERT_DATE': old_row[header_to_index.get('MA10/20_去重日期', 23)] if len(old_row) > 23 else '',
-                'BIAS_ALERT_DATE': old_row[header_to_index.get('乖離率_去重日期', 26)] if len(old_row) > 26 else '',
-                
-                'LOW_DAYS': old_row[header_to_index.get('低點間隔天數', 5)] if len(old_row) > 5 else '999',
-                'HIGH_DAYS': old_row[header_to_index.get('月高點間隔天數', 6)] if len(old_row) > 6 else '999',
-                'MA_TANGLE': old_row[header_to_index.get('均線糾纏狀態', 7)] if len(old_row) > 7 else '不明',
-                'SLOPE_DESC': old_row[header_to_index.get('趨勢斜率描述', 8)] if len(old_row) > 8 else '不明',
-                'BIAS_Val': old_row[header_to_index.get('10日乖離率 (%)', 4)] if len(old_row) > 4 else '0.00%',
-                'MA5_SLOPE': old_row[header_to_index.get('MA5 斜率數值', 27)] if len(old_row) > 27 else 'N/A',
-                'MA10_SLOPE': old_row[header_to_index.get('MA10 斜率數值', 28)] if len(old_row) > 28 else 'N/A',
-                'MA20_SLOPE': old_row[header_to_index.get('MA20 斜率數值', 29)] if len(old_row) > 29 else 'N/A',
-            }
-            
             # 添加調試日誌
-            logger.info(f"📊 {code} - KD開關: {row_data['KD_SWITCH']}, KD上次日期: '{row_data['KD_ALERT_DATE']}'")
-            logger.info(f"📊 {code} - MACD開關: {row_data['MACD_SWITCH']}, MACD上次日期: '{row_data['MACD_ALERT_DATE']}'")
+            logger.info(f"📊 {code} - KD開關: {ta_helpers.read_cell(old_row, column_plan, 'KD_SWITCH')}, KD上次日期: '{ta_helpers.read_cell(old_row, column_plan, 'KD_ALERT_DATE')}'")
+            logger.info(f"📊 {code} - MACD開關: {ta_helpers.read_cell(old_row, column_plan, 'MACD_SWITCH')}, MACD上次日期: '{ta_helpers.read_cell(old_row, column_plan, 'MACD_ALERT_DATE')}'")
 
             # 指標計算
             ma5, ma10, ma20 = sma(c, 5), sma(c, 10), sma(c, 20)
@@ -192,19 +205,17 @@ def analyze_and_update_sheets(gc, spreadsheet_name, stock_codes, stock_df):
             slope_desc = ta_helpers.get_slope_description(s5, s10, s20)
             bias = f"{round(((c[-1] / ma20[-1]) - 1) * 100, 2)}%" if not np.isnan(ma20[-1]) else "N/A"
 
-            row_data.update({
-                'MA_TANGLE': tangle, 'SLOPE_DESC': slope_desc, 'BIAS_Val': bias,
-                'MA5_SLOPE': str(s5), 'MA10_SLOPE': str(s10), 'MA20_SLOPE': str(s20),
-                'LOW_DAYS': str(ta_helpers.find_extreme_time_diff(series_low, float(l[-1]), 'LOW')),
-                'HIGH_DAYS': str(ta_helpers.find_extreme_time_diff(series_high, float(h[-1]), 'HIGH'))
-            })
-
-            provider = old_row[header_to_index.get('提供者', 2)] if len(old_row) > 2 else ""
-            link = ta_helpers.get_static_link(code, provider)
-
-            # 生成警報
-            ta_helpers.process_single_signal('KD', is_kd, kd_sig, code, row_data, COLUMN_MAP, current_date_obj, alerts, [], update_cells_raw, row_idx, link)
-            ta_helpers.process_single_signal('MACD', is_macd, macd_sig, code, row_data, COLUMN_MAP, current_date_obj, alerts, [], update_cells_raw, row_idx, link)
+            # 生成警報 (只有訊號觸發時才建立警報紀錄，避免每檔股票都做連結與極端點掃描)
+            if is_kd or is_macd:
+                provider = ta_helpers.read_cell(old_row, column_plan, 'PROVIDER')
+                record = ta_helpers.AlertRecord(
+                    stock_code=code, link=ta_helpers.get_static_link(code, provider),
+                    tangle=tangle, slope_desc=slope_desc, bias=bias, s5=s5, s10=s10, s20=s20,
+                    low_days=ta_helpers.find_extreme_time_diff(series_low, float(l[-1]), 'LOW'),
+                    high_days=ta_helpers.find_extreme_time_diff(series_high, float(h[-1]), 'HIGH'),
+                )
+                ta_helpers.process_single_signal('KD', is_kd, kd_sig, old_row, column_plan, COLUMN_MAP, current_date_obj, alerts, [], update_cells_raw, row_idx, record, store)
+                ta_helpers.process_single_signal('MACD', is_macd, macd_sig, old_row, column_plan, COLUMN_MAP, current_date_obj, alerts, [], update_cells_raw, row_idx, record, store)
 
             # 輔助數據更新
             for k, v in [('latest_close', round(float(c[-1]), 2)), ('MA5_SLOPE', s5), ('MA10_SLOPE', s10), ('MA20_SLOPE', s20), ('BIAS_Val', bias), ('MA_TANGLE', tangle), ('SLOPE_DESC', slope_desc)]:
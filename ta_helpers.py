@@ -3,7 +3,7 @@ import logging
 import numpy as np
 import pandas as pd
 from datetime import datetime
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, NamedTuple
 
 logger = logging.getLogger(__name__)
 
@@ -122,37 +122,79 @@ def check_cross_signal(current_val_a: float, current_val_b: float, prev_val_a: f
         
     return signal, is_alert
 
-# --- 🚨 核心邏輯修正：process_single_signal (已包含您新增的斜率數值) ---
+# --- 🚨 核心邏輯修正：警報紀錄 (AlertRecord) 與 process_single_signal ---
+
+class AlertRecord(NamedTuple):
+    """單一股票的警報紀錄：只攜帶本次新計算的數值，格式化延後到發送時才進行。"""
+    stock_code: str
+    link: str
+    tangle: str
+    slope_desc: str
+    bias: str
+    s5: float
+    s10: float
+    s20: float
+    low_days: int
+    high_days: int
+    signal_msg: str = ''
+
+
+def read_cell(row: List[str], column_plan: Dict[str, Tuple[int, str]], key: str) -> str:
+    """依照每次執行只解析一次的欄位計畫 (column plan) 讀取儲存格，超出範圍時回傳預設值。"""
+    idx, default = column_plan[key]
+    return row[idx] if idx < len(row) else default
+
+
+def format_alert_message(alert: AlertRecord) -> str:
+    """將 AlertRecord 組合成 Telegram Markdown 訊息 (僅對通過開關與去重的警報呼叫)。"""
+    code_link = f"[{alert.stock_code}]({alert.link})" if alert.link else alert.stock_code
+    slope_values_str = f"MA5:{alert.s5} | MA10:{alert.s10} | MA20:{alert.s20}"
+
+    # 格式化極端點位資訊
+    extreme_info = []
+    if alert.low_days != 999: extreme_info.append(f"日低點間隔: {alert.low_days} 天")
+    if alert.high_days != 999: extreme_info.append(f"月高點間隔: {alert.high_days} 天")
+
+    return (
+        f"🔔 **🚨 {code_link}** (指標警報)\n"
+        f"-> **訊號**：{alert.signal_msg} (今日首次觸發)\n"
+        f"-> **MA趨勢**：{alert.tangle} | {alert.slope_desc}\n"
+        f"-> **斜率數值**：{slope_values_str}\n"
+        f"-> **乖離率**：{alert.bias}\n"
+        f"-> **極端點**：{' | '.join(extreme_info) if extreme_info else '無明顯極端點'}"
+    )
+
 
 def process_single_signal(
     signal_name: str, 
     is_triggered: bool, 
     signal_msg: str, 
-    stock_code: str,
-    row_data: Dict[str, str], 
+    old_row: List[str],
+    column_plan: Dict[str, Tuple[int, str]],
     column_map: Dict[str, str],
     current_date: datetime.date,
-    alerts: List[str],
+    alerts: List[AlertRecord],
     alert_msg_summary: List[str],
     update_cells: List[Tuple[Tuple[str, int], Any]],
     row_num: int,
-    link: str
+    record: AlertRecord,
+    alert_store: Any = None
 ) -> bool:
     """
-    處理單個技術指標訊號的開關、去重、Sheets 更新和警報發送邏輯。
+    處理單個技術指標訊號的開關、去重、Sheets 更新，並將通過的警報紀錄加入 alerts。
+    若提供 alert_store (共用資料模式)，另以共用的警報狀態做跨副本去重。
     """
-    
+    if not is_triggered:
+        return False # 訊號未觸發，直接結束
+
     # 決定開關和去重欄位的 Key
-    if signal_name == 'BIAS':
-        switch_key = 'BIAS_SWITCH'
-        date_key = 'BIAS_ALERT_DATE'
-    else:
-        switch_key = f'{signal_name}_SWITCH'
-        date_key = f'{signal_name}_ALERT_DATE'
+    switch_key = f'{signal_name}_SWITCH'
+    date_key = f'{signal_name}_ALERT_DATE'
+    stock_code = record.stock_code
 
     # 預設值處理：如果欄位不存在或為空，預設為 'ON'
-    switch_val = row_data.get(switch_key, 'ON').upper().strip() 
-    last_alert_date_str = row_data.get(date_key, '')
+    switch_val = read_cell(old_row, column_plan, switch_key).upper().strip()
+    last_alert_date_str = read_cell(old_row, column_plan, date_key)
 
     is_switch_on = (switch_val == 'ON')
     
@@ -165,9 +207,6 @@ def process_single_signal(
         pass 
         
     has_alerted_today = (last_alert_date == current_date)
-    
-    if not is_triggered:
-        return False # 訊號未觸發，直接結束
         
     # 訊號已觸發 (is_triggered == True)
     alert_msg_summary.append(signal_msg) # 總是將訊號結果加入 Sheets 總結欄位
@@ -175,56 +214,30 @@ def process_single_signal(
     # 2. 檢查開關和去重條件
     if is_switch_on and not has_alerted_today:
         
-        # 🚨 觸發警報並發送 Telegram 提醒
+        # 2.0 跨副本去重 (共用資料模式)：只有第一個登記今日警報的副本會發送
+        if alert_store is not None:
+            try:
+                claimed = alert_store.claim_alert(stock_code, signal_name, current_date.strftime('%Y-%m-%d'))
+            except Exception as e:
+                # 共用狀態無法使用時退回只靠 Sheets 去重日期，不中斷整批分析
+                logger.warning(f"⚠️ {stock_code} 的 {signal_msg} 跨副本去重失敗，改用 Sheets 去重: {e}")
+                claimed = True
+            if not claimed:
+                logger.info(f"去重：{stock_code} 的 {signal_msg} 今天已由其他副本發送，跳過 Telegram 通知。")
+                return False
         
         # 2.1 更新 Sheets 獨立去重日期
         update_cells.append(((column_map[date_key], row_num), current_date.strftime('%Y-%m-%d')))
         
-        # 2.2 🚨 創建獨立 Telegram 警報訊息 (包含所有輔助資訊)
-        code_link = f"[{stock_code}]({link})" if link else stock_code 
-        
-        # 抓取所有輔助資訊 (包括新的斜率數值)
-        # 注意：這裡抓取的 row_data 是 ta_analyzer 從 Sheets 讀取到的舊值，
-        # 實際的斜率數值是在 ta_analyzer 中計算並準備寫入 Sheets，
-        # 但由於它們是同時寫入，在單次運行中，這裡應該從 Sheets 中讀取到的舊值為空或舊的。
-        # 為了正確顯示當前最新的斜率值，應該從 ta_analyzer 傳入，但目前結構中做不到。
-        # 暫時使用 Sheets 中的值作為輔助顯示。
-        low_days = row_data.get('LOW_DAYS', '999')
-        high_days = row_data.get('HIGH_DAYS', '999')
-        tangle_state = row_data.get('MA_TANGLE', '不明')
-        slope_desc = row_data.get('SLOPE_DESC', '不明')
-        bias_val = row_data.get('BIAS_Val', '0.00%')
-        
-        # 🚨 新增：斜率數值 (從 Sheets 讀取)
-        s5 = row_data.get('MA5_SLOPE', 'N/A')
-        s10 = row_data.get('MA10_SLOPE', 'N/A')
-        s20 = row_data.get('MA20_SLOPE', 'N/A')
-        
-        slope_values_str = f"MA5:{s5} | MA10:{s10} | MA20:{s20}"
-
-        # 格式化極端點位資訊
-        extreme_info = []
-        if low_days != '999': extreme_info.append(f"日低點間隔: {low_days} 天")
-        if high_days != '999': extreme_info.append(f"月高點間隔: {high_days} 天")
-
-        # 組合 Telegram 訊息
-        formatted_message = (
-            f"🔔 **🚨 {code_link}** (指標警報)\n"
-            f"-> **訊號**：{signal_msg} (今日首次觸發)\n"
-            f"-> **MA趨勢**：{tangle_state} | {slope_desc}\n"
-            f"-> **斜率數值**：{slope_values_str}\n" # 🚨 新增斜率數值行
-            f"-> **乖離率**：{bias_val}\n"
-            f"-> **極端點**：{' | '.join(extreme_info) if extreme_info else '無明顯極端點'}"
-        )
-
-        alerts.append(formatted_message)
+        # 2.2 🚨 記錄警報 (訊息在 bot.py 發送時才由 format_alert_message 格式化)
+        alerts.append(record._replace(signal_msg=signal_msg))
         logger.info(f"✅ {stock_code} 觸發 {signal_msg} 警報，並發送 Telegram 訊息。")
         return True
         
-    elif is_triggered and has_alerted_today:
+    elif has_alerted_today:
         logger.info(f"去重：{stock_code} 的 {signal_msg} 今天已發送過警報，跳過 Telegram 通知。")
         
-    elif is_triggered and not is_switch_on:
+    else:
         logger.info(f"禁用：{stock_code} 的 {signal_msg} 已觸發，但開關為 OFF。")
         
     return False
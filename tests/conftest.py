@@ -0,0 +1,4 @@
+import os, sys
+
+# 專案模組位於根目錄 (bot.py 同層)，測試時加入 sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+
+import ta_helpers
+from ta_analyzer import COLUMN_MAP, build_column_plan
+
+TODAY = date(2026, 10, 19)
+
+
+def make_record(low_days=5, high_days=999):
+    return ta_helpers.AlertRecord(
+        stock_code='2330.TW', link='https://example.com/2330',
+        tangle='多頭發散中', slope_desc='標準多頭', bias='3.21%',
+        s5=1.2345, s10=0.5, s20=0.25, low_days=low_days, high_days=high_days,
+    )
+
+
+def run_signal(row, record=None):
+    column_plan = build_column_plan({'KD_通知開關': 0, 'KD_去重日期': 1})
+    alerts, update_cells = [], []
+    sent = ta_helpers.process_single_signal(
+        'KD', True, 'KD金叉', row, column_plan, COLUMN_MAP,
+        TODAY, alerts, [], update_cells, 7, record or make_record()
+    )
+    return sent, alerts, update_cells
+
+
+def test_triggered_signal_appends_fresh_record_and_date_cell():
+    sent, alerts, update_cells = run_signal(['ON', '2026-10-18'])
+
+    assert sent is True
+    assert len(alerts) == 1
+    alert = alerts[0]
+    assert alert.signal_msg == 'KD金叉'
+    assert (alert.s5, alert.s10, alert.s20) == (1.2345, 0.5, 0.25)
+    assert alert.bias == '3.21%'
+    assert alert.tangle == '多頭發散中'
+    assert update_cells == [((COLUMN_MAP['KD_ALERT_DATE'], 7), '2026-10-19')]
+
+
+def test_switch_off_gives_no_record():
+    sent, alerts, update_cells = run_signal(['OFF', ''])
+    assert sent is False
+    assert alerts == [] and update_cells == []
+
+
+def test_already_alerted_today_gives_no_record():
+    sent, alerts, update_cells = run_signal(['ON', '2026-10-19'])
+    assert sent is False
+    assert alerts == [] and update_cells == []
+
+
+def test_format_alert_message_without_extreme_points():
+    msg = ta_helpers.format_alert_message(make_record(low_days=999, high_days=999)._replace(signal_msg='KD金叉'))
+    assert '[2330.TW](https://example.com/2330)' in msg
+    assert 'KD金叉' in msg
+    assert 'MA5:1.2345 | MA10:0.5 | MA20:0.25' in msg
+    assert '3.21%' in msg
+    assert '無明顯極端點' in msg
+
+
+def test_read_cell_falls_back_past_end_of_short_row():
+    column_plan = build_column_plan({})  # 找不到表頭時使用預設索引
+    assert ta_helpers.read_cell(['2330'], column_plan, 'KD_SWITCH') == 'ON'
+    assert ta_helpers.read_cell(['2330'], column_plan, 'KD_ALERT_DATE') == ''
+    row = ['2330', '台積電', '台股'] + [''] * 7 + ['OFF']
+    assert ta_helpers.read_cell(row, column_plan, 'KD_SWITCH') == 'OFF'
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+from contextlib import closing
+from datetime import date
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import shared_store
+import ta_analyzer
+import ta_helpers
+from shared_store import SharedStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # 可控制的時鐘，避免測試依賴 sleep
+    now = [1_000_000.0]
+    monkeypatch.setattr(shared_store, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def replicas(tmp_path, clock):
+    path = str(tmp_path / "shared.db")
+    a = SharedStore(path, "A", lease_seconds=90, bar_max_age=600)
+    b = SharedStore(path, "B", lease_seconds=90, bar_max_age=600)
+    return a, b
+
+
+def test_second_replica_refused_while_lease_live(replicas, clock):
+    a, b = replicas
+    assert a.try_acquire_leader()
+    assert not b.try_acquire_leader()
+    clock[0] += 60
+    assert a.try_acquire_leader()  # 續約
+    clock[0] += 60
+    assert not b.try_acquire_leader()
+    assert a.current_leader() == "A"
+
+
+def test_takeover_after_expiry(replicas, clock):
+    a, b = replicas
+    assert a.try_acquire_leader()
+    clock[0] += 91
+    assert a.current_leader() is None
+    assert b.try_acquire_leader()
+    assert not a.try_acquire_leader()
+    assert b.current_leader() == "B"
+
+
+def test_takeover_immediately_after_release(replicas):
+    a, b = replicas
+    assert a.try_acquire_leader()
+    b.release_leader()  # 非持有者釋放不影響租約
+    assert not b.try_acquire_leader()
+    a.release_leader()
+    assert b.try_acquire_leader()
+
+
+def test_lock_contention_treated_as_not_leader(replicas, monkeypatch):
+    a, b = replicas
+    monkeypatch.setattr(SharedStore, "LEASE_LOCK_TIMEOUT", 0.05)
+    with closing(a._connect()) as holder:
+        holder.execute("BEGIN IMMEDIATE")  # 模擬其他副本持有寫入鎖
+        assert not b.try_acquire_leader()
+        holder.execute("ROLLBACK")
+    assert b.try_acquire_leader()
+
+
+def test_claim_alert_once_per_key(replicas):
+    a, b = replicas
+    assert a.claim_alert("2330.TW", "KD", "2026-10-19")
+    assert not b.claim_alert("2330.TW", "KD", "2026-10-19")
+    assert not a.claim_alert("2330.TW", "KD", "2026-10-19")
+    assert b.claim_alert("2330.TW", "MACD", "2026-10-19")
+    assert b.claim_alert("2317.TW", "KD", "2026-10-19")
+    assert a.claim_alert("2330.TW", "KD", "2026-10-20")
+
+
+def test_claim_alert_prunes_previous_days(replicas):
+    a, b = replicas
+    a.claim_alert("2330.TW", "KD", "2026-10-18")
+    a.claim_alert("2330.TW", "KD", "2026-10-19")
+    with closing(a._connect()) as conn:
+        dates = [r[0] for r in conn.execute("SELECT alert_date FROM alert_state")]
+    assert dates == ["2026-10-19"]
+
+
+def test_bars_round_trip_and_max_age(replicas, clock):
+    a, b = replicas
+    index = pd.date_range("2026-01-01", periods=25, freq="D")
+    df = pd.DataFrame({
+        "Close": [float(i) for i in range(25)],
+        "High": [i + 1.5 for i in range(25)],
+        "Low": [i - 0.5 for i in range(25)],
+        "Volume": [100] * 25,
+    }, index=index)
+    a.put_bars("2330.TW", df)
+
+    cached = b.get_bars("2330.TW")
+    assert list(cached.columns) == ["Close", "High", "Low"]
+    assert (cached.index == index).all()
+    assert cached["Close"].tolist() == df["Close"].tolist()
+    assert cached["High"].tolist() == df["High"].tolist()
+    assert cached["Low"].tolist() == df["Low"].tolist()
+
+    assert b.get_bars("2317.TW") is None
+    clock[0] += 601
+    assert b.get_bars("2330.TW") is None
+    assert b.get_bars("2330.TW", allow_stale=True)["Close"].tolist() == df["Close"].tolist()
+
+
+def make_bars(n=25):
+    index = pd.date_range("2026-01-01", periods=n, freq="D")
+    return pd.DataFrame({"Close": [1.0] * n, "High": [2.0] * n, "Low": [0.5] * n}, index=index)
+
+
+def test_download_falls_back_to_stale_cache(replicas, clock, monkeypatch):
+    a, b = replicas
+    a.put_bars("2330.TW", make_bars())
+    clock[0] += 1800  # 下一個排程時段，快取已過期
+
+    def failing_download(*args, **kwargs):
+        raise ConnectionError("offline")
+
+    monkeypatch.setattr(ta_analyzer.yf, "download", failing_download)
+    ticker, status, data = ta_analyzer.download_one_stock("2330", b)
+    assert (ticker, status) == ("2330.TW", "ok")
+    assert len(data) == 25
+
+    monkeypatch.setattr(ta_analyzer.yf, "download", lambda *args, **kwargs: make_bars(5))
+    assert ta_analyzer.download_one_stock("2330", b)[1] == "ok"
+    assert ta_analyzer.download_one_stock("2317", b)[1] == "error"
+
+
+def run_kd_signal(store):
+    column_plan = {'KD_SWITCH': (0, 'ON'), 'KD_ALERT_DATE': (1, '')}
+    record = ta_helpers.AlertRecord('2330.TW', '', '均線糾纏', '標準多頭', '1.2%', 0.1, 0.2, 0.3, 5, 999)
+    alerts, update_cells = [], []
+    sent = ta_helpers.process_single_signal(
+        'KD', True, 'KD金叉', ['ON', '2026-10-18'], column_plan, {'KD_ALERT_DATE': 'L'},
+        date(2026, 10, 19), alerts, [], update_cells, 5, record, store
+    )
+    return sent, alerts, update_cells
+
+
+class RefusingStore:
+    """本機替身：模擬其他副本已登記今日警報。"""
+
+    def __init__(self):
+        self.claims = []
+
+    def claim_alert(self, stock_code, signal_name, alert_date):
+        self.claims.append((stock_code, signal_name, alert_date))
+        return False
+
+
+def test_process_single_signal_skips_when_claim_refused():
+    store = RefusingStore()
+    sent, alerts, update_cells = run_kd_signal(store)
+
+    assert sent is False
+    assert alerts == []
+    assert update_cells == []
+    assert store.claims == [('2330.TW', 'KD', '2026-10-19')]
+
+
+class LockedStore:
+    """本機替身：模擬共用資料庫被鎖住。"""
+
+    def claim_alert(self, stock_code, signal_name, alert_date):
+        raise sqlite3.OperationalError("database is locked")
+
+
+def test_process_single_signal_falls_back_to_sheet_dedup_when_claim_fails():
+    sent, alerts, update_cells = run_kd_signal(LockedStore())
+
+    assert sent is True
+    assert [a.signal_msg for a in alerts] == ['KD金叉']
+    assert update_cells == [(('L', 5), '2026-10-19')]